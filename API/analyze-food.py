@@ -1,15 +1,34 @@
 from fastapi import FastAPI, Request, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 import logging
+import asyncio
 import json
+import re
 import os
 import io
 import base64
+import hashlib
+import threading
+import time
+from contextlib import asynccontextmanager
+from abc import ABC, abstractmethod
+from types import MappingProxyType
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PIL import Image
+from cachetools import LRUCache, TTLCache
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+except ImportError:
+    TurboJPEG = None
 from dotenv import load_dotenv
 from google.cloud import vision
 import torch
+import torch.nn.functional as F
+from torchvision.transforms import v2 as transforms
 from transformers import CLIPProcessor, CLIPModel
 
 # Configure logging
@@ -20,8 +39,20 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# Load CLIP when a serving process starts, rather than at import time, so the
+# uvicorn supervisor and multiprocessing re-imports of this file never load it
+@asynccontextmanager
+async def lifespan(app):
+    """Loads CLIP before the app starts serving requests"""
+    try:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, load_clip)
+    except Exception as e:
+        logger.error(f"Error loading CLIP at startup: {e}")
+    yield
+
 # Initialize FastAPI app
-app = FastAPI(title="Food Analysis API")
+app = FastAPI(title="Food Analysis API", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -43,7 +74,7 @@ def setup_google_vision():
         
         # Create credentials from JSON content
         credentials_info = json.loads(google_credentials_json)
-        vision_client = vision.ImageAnnotatorClient.from_service_account_info(credentials_info)
+        vision_client = vision.ImageAnnotatorAsyncClient.from_service_account_info(credentials_info)
         return vision_client
     except Exception as e:
         logger.error(f"Error setting up Google Vision: {e}")
@@ -53,13 +84,150 @@ def setup_google_vision():
 def setup_clip_model():
     """Set up CLIP model with error handling"""
     try:
-        clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        if device == "cuda":
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.benchmark = True
+        
+        # Stream safetensors weights straight into their final dtype to keep load time and
+        # peak memory down; CPU keeps FP32 weights for INT8 dynamic quantization below
+        clip_model = CLIPModel.from_pretrained(
+            "openai/clip-vit-base-patch32",
+            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+            low_cpu_mem_usage=True,
+            use_safetensors=True,
+        ).to(device).eval()
         clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-        return clip_model, clip_processor
+        
+        # Without a GPU, dynamically quantize linear layers to INT8 for faster CPU inference
+        if device == "cpu":
+            clip_model = quantize_image_tower(clip_model)
+        
+        logger.info(f"CLIP model loaded on {device}")
+        return clip_model, clip_processor, device
     except Exception as e:
         logger.error(f"Error loading CLIP model: {e}")
         raise
 
+# INT8 dynamic quantization of the CLIP layers that run per request
+def quantize_image_tower(clip_model):
+    """Quantizes the CLIP vision tower, keeping FP32 if quantization fails"""
+    # The text model only encodes FOOD_LABELS once at startup, so it stays FP32
+    # where quantizing it would cost label accuracy for no speedup
+    try:
+        vision_model = torch.ao.quantization.quantize_dynamic(
+            clip_model.vision_model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        # quantize_dynamic only swaps child modules, so wrap the bare projection Linear
+        visual_projection = torch.ao.quantization.quantize_dynamic(
+            torch.nn.Sequential(clip_model.visual_projection), {torch.nn.Linear}, dtype=torch.qint8
+        )[0]
+        # Hosts without a usable quantized engine only fail once the kernels run
+        with torch.inference_mode():
+            pooled_output = vision_model(pixel_values=torch.zeros(1, 3, 224, 224), return_dict=False)[1]
+            visual_projection(pooled_output)
+    except Exception as e:
+        logger.warning(f"Could not quantize CLIP image tower, using FP32: {e}")
+        return clip_model
+
+    # Only swap in the quantized modules once both succeeded
+    clip_model.vision_model = vision_model
+    clip_model.visual_projection = visual_projection
+    return clip_model
+
+# Fixed vocabulary of ingredients CLIP chooses from
+FOOD_LABELS = [
+    "apple", "banana", "bread", "pasta", 
+    "chicken", "salad", "cheese", "rice", 
+    "fish", "steak", "tomato", "broccoli", 
+    "carrot", "salmon", "burger"
+]
+
+# CLIP image preprocessing as a tensor transform pipeline, equivalent to CLIPProcessor
+CLIP_MEAN = [0.48145466, 0.4578275, 0.40821073]
+CLIP_STD = [0.26862954, 0.26130258, 0.27577711]
+CLIP_TRANSFORM = transforms.Compose([
+    transforms.ToImage(),
+    transforms.Resize(224, interpolation=transforms.InterpolationMode.BICUBIC, antialias=True),
+    transforms.CenterCrop(224),
+    transforms.ToDtype(torch.float32, scale=True),
+    transforms.Normalize(mean=CLIP_MEAN, std=CLIP_STD),
+])
+
+# Precompute normalized CLIP text embeddings for the food labels
+def setup_text_features(clip_model, clip_processor, device):
+    """Encodes FOOD_LABELS once so requests only run the image encoder"""
+    try:
+        text_inputs = clip_processor(text=FOOD_LABELS, return_tensors="pt", padding=True).to(device)
+        with torch.inference_mode():
+            text_features = clip_model.get_text_features(**text_inputs)
+        return F.normalize(text_features.float(), dim=-1)
+    except Exception as e:
+        logger.error(f"Error encoding CLIP text labels: {e}")
+        raise
+
+# Image tower of CLIP as a single tensor-in/tensor-out module
+class CLIPImageEncoder(torch.nn.Module):
+    """Equivalent of CLIPModel.get_image_features, traceable by TorchScript"""
+    def __init__(self, clip_model):
+        super().__init__()
+        self.vision_model = clip_model.vision_model
+        self.visual_projection = clip_model.visual_projection
+
+    def forward(self, pixel_values):
+        pooled_output = self.vision_model(pixel_values=pixel_values, return_dict=False)[1]
+        return self.visual_projection(pooled_output)
+
+# Compile the CLIP image encoder ahead of time
+def setup_image_encoder(clip_model, device):
+    """Traces the CLIP image encoder on a dummy input, falling back to eager mode"""
+    image_encoder = CLIPImageEncoder(clip_model).eval()
+    try:
+        dummy = torch.zeros(1, 3, 224, 224, device=device)
+        # torch.jit.trace rather than script: scripted softmax paths are unreliable
+        with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16, enabled=device == "cuda"):
+            traced_encoder = torch.jit.trace(image_encoder, dummy, check_trace=False)
+        return torch.jit.optimize_for_inference(traced_encoder)
+    except Exception as e:
+        logger.warning(f"Could not trace CLIP image encoder, using eager mode: {e}")
+        return image_encoder
+
+# Largest batch CLIPBatcher sends through the image encoder
+CLIP_MAX_BATCH_SIZE = 16
+# Seconds a request waits for its CLIP batch before giving up
+CLIP_RESULT_TIMEOUT = 30
+
+# Run dummy forward passes so cuDNN autotuning and JIT profiling happen at startup
+def warmup_image_encoder(image_encoder, clip_model, device, max_batch_size=CLIP_MAX_BATCH_SIZE, passes=2):
+    """Warms up the CLIP image encoder, falling back to eager mode if it fails on full batches"""
+    # cuDNN autotuning only exists on CUDA, so on CPU full-batch passes would just
+    # add startup time; check and warm up at batch size 1 there
+    batch_sizes = (1, max_batch_size) if device == "cuda" else (1,)
+    eager_encoder = CLIPImageEncoder(clip_model).eval()
+    generator = torch.Generator().manual_seed(0)
+    with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16, enabled=device == "cuda"):
+        # The traced graph was recorded at batch size 1, so check it at every size
+        # warmup covers against the eager encoder before serving requests with it
+        if not isinstance(image_encoder, CLIPImageEncoder):
+            try:
+                for batch_size in batch_sizes:
+                    sample = torch.randn(batch_size, 3, 224, 224, generator=generator).to(device)
+                    expected = eager_encoder(sample).float()
+                    actual = image_encoder(sample).float()
+                    if actual.shape != expected.shape or not torch.allclose(actual, expected, rtol=1e-2, atol=1e-2):
+                        raise RuntimeError(f"traced output differs from eager at batch size {batch_size}")
+            except Exception as e:
+                logger.warning(f"Traced CLIP image encoder failed check, using eager mode: {e}")
+                image_encoder = eager_encoder
+
+        for batch_size in batch_sizes:
+            dummy = torch.zeros(batch_size, 3, 224, 224, device=device)
+            for _ in range(passes):
+                image_encoder(dummy)
+    if device == "cuda":
+        torch.cuda.synchronize()
+    return image_encoder
+
 # Validate API keys
 def validate_api_keys():
     """Validate required API keys"""
@@ -71,62 +239,302 @@ def validate_api_keys():
 # Initialize global variables
 try:
     validate_api_keys()
-    vision_client = setup_google_vision()
-    clip_model, clip_processor = setup_clip_model()
     
     # USDA API credentials
     USDA_API_KEY = os.getenv("USDA_API_KEY")
     USDA_API_URL = "https://api.nal.usda.gov/fdc/v1/foods/search"
 except Exception as e:
     logger.error(f"Initialization error: {e}")
-    vision_client = None
-    clip_model = None
-    clip_processor = None
     USDA_API_KEY = None
     USDA_API_URL = None
 
+# CLIP state, filled in by load_clip inside the serving process
+clip_model = None
+clip_processor = None
+device = "cpu"
+TEXT_FEATS = None
+image_encoder = None
+CLIP_LOAD_LOCK = threading.Lock()
+
+# After a failed load, requests fail fast until this many seconds have passed
+CLIP_LOAD_RETRY_SECONDS = 300
+clip_load_error = None
+clip_load_retry_at = 0.0
+
+def check_clip_load_backoff():
+    """Raises the last load error while the retry backoff is still running"""
+    if clip_load_error is not None and time.monotonic() < clip_load_retry_at:
+        raise RuntimeError(f"CLIP model unavailable: {clip_load_error}")
+
+def load_clip():
+    """Loads CLIP, the label embeddings and the image encoder once per process"""
+    global clip_model, clip_processor, device, TEXT_FEATS, image_encoder
+    global clip_load_error, clip_load_retry_at
+    with CLIP_LOAD_LOCK:
+        if image_encoder is not None:
+            return
+        # Requests that queued on the lock behind a failed load give up here
+        check_clip_load_backoff()
+        try:
+            model, processor, model_device = setup_clip_model()
+            text_features = setup_text_features(model, processor, model_device)
+            encoder = setup_image_encoder(model, model_device)
+            encoder = warmup_image_encoder(encoder, model, model_device)
+        except Exception as e:
+            clip_load_error = e
+            clip_load_retry_at = time.monotonic() + CLIP_LOAD_RETRY_SECONDS
+            raise
+        clip_model, clip_processor, device, TEXT_FEATS, image_encoder = (
+            model, processor, model_device, text_features, encoder
+        )
+        clip_load_error = None
+
+# Keywords marking a Vision label as food-related, matched anywhere in the label
+FOOD_KEYWORDS = ['food', 'fruit', 'vegetable', 'meat', 'fish', 'bread', 'cheese', 'drink']
+FOOD_KEYWORDS_RE = re.compile("|".join(map(re.escape, FOOD_KEYWORDS)), re.IGNORECASE)
+
+# Coalesce concurrent requests into batches collected by a single worker task
+class RequestBatcher(ABC):
+    """Buffers submitted items for up to flush_ms and processes them in batches"""
+    def __init__(self, max_batch_size=16, flush_ms=10, max_batch_bytes=None, max_concurrent_batches=1,
+                 result_timeout=30):
+        self.max_batch_size = max_batch_size
+        self.flush_ms = flush_ms
+        self.max_batch_bytes = max_batch_bytes
+        self.max_concurrent_batches = max_concurrent_batches
+        self.result_timeout = result_timeout
+        self.loop = None
+        self.queue = None
+        self.worker = None
+        self.batch_slots = None
+        self.in_flight = set()
+
+    async def submit(self, item):
+        """Queues an item and waits for its result"""
+        self._bind_loop()
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run())
+
+        future = self.loop.create_future()
+        await self.queue.put((item, future))
+        # A stuck batch turns into an error for its callers instead of a hung request
+        return await asyncio.wait_for(future, self.result_timeout)
+
+    def _bind_loop(self):
+        # Serverless adapters such as Vercel's may run each request on a fresh event
+        # loop, and queues, semaphores and tasks cannot be shared across loops
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.batch_slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self.worker = None
+        self.in_flight = set()
+        self.on_new_loop()
+
+    def on_new_loop(self):
+        """Drops any other state tied to the previous event loop"""
+
+    @abstractmethod
+    async def process_batch(self, items):
+        """Returns one result per item, in order"""
+
+    def item_size(self, item):
+        """Size of an item counted against max_batch_bytes"""
+        return 0
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        carried_entry = None
+        while True:
+            # Wait for a free slot first, so with a single slot the next batch
+            # collects everything queued while the previous one was running
+            await self.batch_slots.acquire()
+            if carried_entry is not None:
+                entry, carried_entry = carried_entry, None
+            else:
+                entry = await self.queue.get()
+            batch = [entry]
+            batch_bytes = self.item_size(entry[0])
+            deadline = loop.time() + self.flush_ms / 1000
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                entry_bytes = self.item_size(entry[0])
+                if self.max_batch_bytes is not None and batch_bytes + entry_bytes > self.max_batch_bytes:
+                    # Start the next batch with this item instead of overflowing this one
+                    carried_entry = entry
+                    break
+                batch.append(entry)
+                batch_bytes += entry_bytes
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self.in_flight.add(task)
+            task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task):
+        self.in_flight.discard(task)
+        self.batch_slots.release()
+
+    async def _dispatch(self, batch):
+        try:
+            results = await self.process_batch([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+# Coalesce concurrent Vision API requests into batched calls
+class VisionBatcher(RequestBatcher):
+    """Sends buffered label-detection requests via batch_annotate_images"""
+    # Batches run in parallel like independent calls did, and are capped well under
+    # Vision's 10 MB request limit so one large photo cannot fail its neighbours
+    def __init__(self, client_factory, max_batch_size=16, flush_ms=10,
+                 max_batch_bytes=8 * 1024 * 1024, max_concurrent_batches=32,
+                 rpc_timeout=10, result_timeout=15):
+        super().__init__(max_batch_size, flush_ms, max_batch_bytes, max_concurrent_batches, result_timeout)
+        # The async gRPC client binds to the event loop it is created on, so it
+        # is built lazily inside the serving loop rather than at import time
+        self.client_factory = client_factory
+        self.client = None
+        self.rpc_timeout = rpc_timeout
+
+    def on_new_loop(self):
+        self.client = None
+
+    async def process_batch(self, images_bytes):
+        if self.client is None:
+            self.client = self.client_factory()
+        annotate_requests = [
+            {
+                "image": vision.Image(content=image_bytes),
+                "features": [{"type_": vision.Feature.Type.LABEL_DETECTION}],
+            }
+            for image_bytes in images_bytes
+        ]
+        response = await self.client.batch_annotate_images(
+            requests=annotate_requests, timeout=self.rpc_timeout
+        )
+        return response.responses
+
+    def item_size(self, image_bytes):
+        return len(image_bytes)
+
+# Coalesce concurrent CLIP requests into batched forward passes; like VisionBatcher
+# it rebinds to each new event loop, so no state here may outlive a loop
+class CLIPBatcher(RequestBatcher):
+    """Runs buffered pixel tensors through the CLIP image encoder as one batch"""
+    async def process_batch(self, pixel_tensors):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._forward, pixel_tensors)
+
+    def _forward(self, pixel_tensors):
+        pixel_values = torch.cat(pixel_tensors).to(device, non_blocking=True)
+
+        # FP16 autocast only pays off on CUDA; on CPU run in plain FP32
+        with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16, enabled=device == "cuda"):
+            image_features = image_encoder(pixel_values)
+            image_features = F.normalize(image_features.float(), dim=-1)
+            logits = ((image_features @ TEXT_FEATS.T) * clip_model.logit_scale.exp()).float()
+
+        return list(logits.cpu())
+
+vision_batcher = VisionBatcher(setup_google_vision)
+clip_batcher = CLIPBatcher(max_batch_size=CLIP_MAX_BATCH_SIZE, result_timeout=CLIP_RESULT_TIMEOUT)
+
 # Function to get food items using Google Vision API
-def detect_food_vision(image_bytes):
-    """Detects food items in an image using Google Vision API"""
+async def detect_food_vision(image_bytes):
+    """Detects food items in an image using Google Vision API, also returning all scored labels"""
     try:
-        image = vision.Image(content=image_bytes)
-        response = vision_client.label_detection(image=image)
+        response = await vision_batcher.submit(image_bytes)
+        if response.error.message:
+            raise RuntimeError(response.error.message)
         labels = response.label_annotations
         
         # Filter and sort food-related labels
         food_items = [
             label.description 
             for label in labels 
-            if label.score > 0.6 and any(food in label.description.lower() for food in [
-                'food', 'fruit', 'vegetable', 'meat', 'fish', 'bread', 'cheese', 'drink'
-            ])
+            if label.score > 0.6 and FOOD_KEYWORDS_RE.search(label.description)
         ]
         
-        return food_items[:5] if food_items else ["No specific food detected"]
+        scored_labels = [(label.description, label.score) for label in labels]
+        return (food_items[:5] if food_items else ["No specific food detected"]), scored_labels
     except Exception as e:
         logger.error(f"Vision API error: {e}")
-        return [f"Error in Vision API: {str(e)}"]
+        return [f"Error in Vision API: {str(e)}"], []
 
-# Function to classify ingredients using CLIP
-def classify_ingredients(image_bytes):
-    """Classifies main ingredient using CLIP"""
+# Vision labels this confident that name a CLIP label make running CLIP unnecessary
+VISION_MATCH_THRESHOLD = 0.85
+# Seconds CLIP waits for Vision before starting anyway
+VISION_HEAD_START = 0.15
+FOOD_LABEL_SET = frozenset(FOOD_LABELS)
+
+def match_food_label(scored_labels):
+    """Returns the first confident Vision label that is in the CLIP vocabulary"""
+    return next(
+        (
+            description.lower()
+            for description, score in scored_labels
+            if score > VISION_MATCH_THRESHOLD and description.lower() in FOOD_LABEL_SET
+        ),
+        None,
+    )
+
+# libjpeg-turbo decoder for JPEG uploads, if the library is available
+def setup_turbojpeg():
+    """Set up TurboJPEG decoder, returning None when libjpeg-turbo is missing"""
+    if TurboJPEG is None:
+        logger.warning("PyTurboJPEG is not installed, decoding images with PIL")
+        return None
     try:
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        food_labels = [
-            "apple", "banana", "bread", "pasta", 
-            "chicken", "salad", "cheese", "rice", 
-            "fish", "steak", "tomato", "broccoli", 
-            "carrot", "salmon", "burger"
-        ]
+        return TurboJPEG()
+    except Exception as e:
+        logger.warning(f"TurboJPEG unavailable, decoding images with PIL: {e}")
+        return None
 
-        inputs = clip_processor(text=food_labels, images=image, return_tensors="pt", padding=True)
-        outputs = clip_model(**inputs)
-        logits_per_image = outputs.logits_per_image
-        probs = logits_per_image.softmax(dim=1)
+turbo_jpeg = setup_turbojpeg()
 
-        top_ingredient_index = torch.argmax(probs)
-        top_ingredient = food_labels[top_ingredient_index]
-        confidence = probs[0][top_ingredient_index].item()
+# Decode uploaded image bytes once so the result can be shared
+def decode_image(image_bytes):
+    """Decodes image bytes into an RGB image accepted by CLIP_TRANSFORM"""
+    # JPEGs decode straight to an RGB uint8 CHW tensor, skipping PIL
+    if turbo_jpeg is not None and image_bytes[:2] == b"\xff\xd8":
+        try:
+            pixels = turbo_jpeg.decode(image_bytes, pixel_format=TJPF_RGB)
+            return torch.from_numpy(pixels).permute(2, 0, 1)
+        except Exception as e:
+            # e.g. CMYK/YCCK JPEGs, which PIL can still convert to RGB
+            logger.info(f"TurboJPEG could not decode image, falling back to PIL: {e}")
+    return Image.open(io.BytesIO(image_bytes)).convert("RGB")
+
+# Function to classify ingredients using CLIP
+async def classify_ingredients(image):
+    """Classifies main ingredient of a decoded RGB image using CLIP"""
+    try:
+        loop = asyncio.get_running_loop()
+        # Runtimes that skip the lifespan hook load CLIP on first use instead
+        if image_encoder is None:
+            check_clip_load_backoff()
+            await loop.run_in_executor(None, load_clip)
+        pixel_values = await loop.run_in_executor(None, CLIP_TRANSFORM, image)
+        logits = await clip_batcher.submit(pixel_values.unsqueeze(0))
+
+        # argmax is unchanged by softmax, so only the winner's probability is computed
+        top_ingredient_index = int(logits.argmax().item())
+        top_ingredient = FOOD_LABELS[top_ingredient_index]
+        confidence = (1.0 / torch.exp(logits - logits[top_ingredient_index]).sum()).item()
 
         logger.info(f"Classified ingredient: {top_ingredient} with confidence: {confidence}")
         return top_ingredient
@@ -134,14 +542,38 @@ def classify_ingredients(image_bytes):
         logger.error(f"CLIP Model error: {e}")
         return f"Error in CLIP Model: {str(e)}"
 
+# Shared USDA HTTP session so TCP/TLS connections are reused across requests
+def setup_usda_session():
+    """Set up a pooled requests session with retries for the USDA API"""
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+    session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retry))
+    return session
+
+USDA_SESSION = setup_usda_session()
+
+# Successful USDA lookups, keyed on the normalized ingredient name
+NUTRITION_CACHE = TTLCache(maxsize=1024, ttl=86400)
+NUTRITION_CACHE_LOCK = threading.Lock()
+
 # Function to fetch nutrition data
 def get_nutrition_data(ingredient):
     """Fetches nutrition data for a given ingredient"""
+    key = ingredient.lower().strip()
+    with NUTRITION_CACHE_LOCK:
+        if key in NUTRITION_CACHE:
+            return NUTRITION_CACHE[key]
+
     try:
-        response = requests.get(f"{USDA_API_URL}?query={ingredient}&api_key={USDA_API_KEY}")
+        # Only the top hit is used, so ask USDA for a single result
+        response = USDA_SESSION.get(
+            USDA_API_URL,
+            params={"query": key, "api_key": USDA_API_KEY, "pageSize": 1},
+            timeout=(3, 7),
+        )
 
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             if "foods" in data and data["foods"]:
                 food = data["foods"][0]
                 nutrients = {
@@ -149,31 +581,160 @@ def get_nutrition_data(ingredient):
                     for nutrient in food.get("foodNutrients", [])
                 }
 
-                return {
+                nutrition_info = {
                     "name": food["description"],
                     "calories": round(nutrients.get("Energy (kcal)", 0), 2),
                     "protein": round(nutrients.get("Protein", 0), 2),
                     "carbs": round(nutrients.get("Carbohydrate, by difference", 0), 2),
                     "fats": round(nutrients.get("Total lipid (fat)", 0), 2),
                 }
+                with NUTRITION_CACHE_LOCK:
+                    NUTRITION_CACHE[key] = nutrition_info
+                return nutrition_info
         return {"error": "No nutrition data found"}
     except Exception as e:
         logger.error(f"Nutrition data fetch error: {e}")
         return {"error": f"Failed to fetch nutrition data: {str(e)}"}
 
+async def get_nutrition_data_async(ingredient):
+    """Runs get_nutrition_data in the default executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, get_nutrition_data, ingredient)
+
+# Vision and CLIP results keyed on a hash of the image content, so retries and
+# duplicate uploads skip both models
+PIPELINE_CACHE = LRUCache(maxsize=512)
+
+# Healthier alternatives keyed on casefolded ingredient name
+ALTERNATIVES = MappingProxyType({
+    "pasta": "Try zucchini noodles or whole wheat pasta for fewer calories and more nutrients.",
+    "chicken": "Consider grilled tofu or salmon for lean protein with healthy omega-3 fatty acids.",
+    "bread": "Opt for whole grain or sourdough bread with more fiber and lower glycemic index.",
+    "banana": "Try mixed berries or an apple for lower sugar content and more varied nutrients.",
+    "cheese": "Choose low-fat cheese or nutritional yeast for a healthier, protein-rich alternative.",
+    "rice": "Swap with quinoa or cauliflower rice for higher protein and lower carbohydrate content.",
+    "steak": "Try lean turkey, grilled fish, or plant-based protein for a heart-healthy option.",
+})
+DEFAULT_ALTERNATIVE = "No specific alternative found. Consider consulting a nutritionist for personalized advice."
+
 # Function to suggest healthier alternatives
 def suggest_alternative(food_item):
     """Suggests a healthier alternative for a given food item"""
-    alternatives = {
-        "pasta": "Try zucchini noodles or whole wheat pasta for fewer calories and more nutrients.",
-        "chicken": "Consider grilled tofu or salmon for lean protein with healthy omega-3 fatty acids.",
-        "bread": "Opt for whole grain or sourdough bread with more fiber and lower glycemic index.",
-        "banana": "Try mixed berries or an apple for lower sugar content and more varied nutrients.",
-        "cheese": "Choose low-fat cheese or nutritional yeast for a healthier, protein-rich alternative.",
-        "rice": "Swap with quinoa or cauliflower rice for higher protein and lower carbohydrate content.",
-        "steak": "Try lean turkey, grilled fish, or plant-based protein for a heart-healthy option.",
-    }
-    return alternatives.get(food_item.lower(), "No specific alternative found. Consider consulting a nutritionist for personalized advice.")
+    return ALTERNATIVES.get(food_item.casefold(), DEFAULT_ALTERNATIVE)
+
+# Run the analysis pipeline, yielding each part of the result as soon as it is ready
+async def analyze_image(image_bytes):
+    """Yields partial analysis results for an image as each stage finishes"""
+    tasks = []
+    try:
+        # Reuse Vision and CLIP results for images that were already analyzed
+        image_key = hashlib.blake2b(image_bytes, digest_size=16).digest()
+        cached_result = PIPELINE_CACHE.get(image_key)
+        if cached_result is not None:
+            detected_food, main_ingredient = cached_result
+            logger.info("Reusing cached analysis for image")
+            logger.info(f"Detected foods: {detected_food}")
+            logger.info(f"Main ingredient: {main_ingredient}")
+            yield {"detected_food": detected_food}
+            yield {"main_ingredient": main_ingredient}
+            
+            # Start fetching nutrition data while the suggestion is prepared
+            nutrition_task = asyncio.create_task(get_nutrition_data_async(main_ingredient))
+            tasks.append(nutrition_task)
+        else:
+            # Detect food using Google Vision API, which takes the raw bytes
+            loop = asyncio.get_running_loop()
+            vision_started = loop.time()
+            vision_task = asyncio.create_task(detect_food_vision(image_bytes))
+            tasks.append(vision_task)
+            
+            # Decode the image once for CLIP while the Vision request is in flight
+            try:
+                image = await loop.run_in_executor(None, decode_image, image_bytes)
+            except Exception as e:
+                logger.error(f"Image decode error: {e}")
+                yield {"error": f"Invalid image file: {str(e)}"}
+                return
+            
+            # Give Vision a short head start: a confident hit that arrives quickly makes
+            # CLIP unnecessary, while a slow Vision call must not hold CLIP back
+            head_start = VISION_HEAD_START - (loop.time() - vision_started)
+            if head_start > 0:
+                await asyncio.wait({vision_task}, timeout=head_start)
+            
+            detected_food = None
+            main_ingredient = None
+            if vision_task.done():
+                detected_food, scored_labels = vision_task.result()
+                logger.info(f"Detected foods: {detected_food}")
+                yield {"detected_food": detected_food}
+                main_ingredient = match_food_label(scored_labels)
+            
+            if main_ingredient is not None:
+                logger.info(f"Using Vision label {main_ingredient}, skipping CLIP")
+            else:
+                # Classify main ingredient using CLIP concurrently with any pending Vision call
+                clip_task = asyncio.create_task(classify_ingredients(image))
+                tasks.append(clip_task)
+                pending = {clip_task} if detected_food is not None else {clip_task, vision_task}
+                while main_ingredient is None:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    if vision_task in done:
+                        detected_food, scored_labels = vision_task.result()
+                        logger.info(f"Detected foods: {detected_food}")
+                        yield {"detected_food": detected_food}
+                        # A confident Vision label that beats CLIP still wins
+                        vision_label = match_food_label(scored_labels)
+                        if vision_label is not None and not clip_task.done():
+                            clip_task.cancel()
+                            main_ingredient = vision_label
+                            logger.info(f"Using Vision label {main_ingredient}, cancelling CLIP")
+                    if main_ingredient is None and clip_task in done:
+                        main_ingredient = clip_task.result()
+            logger.info(f"Main ingredient: {main_ingredient}")
+            yield {"main_ingredient": main_ingredient}
+            
+            # Start fetching nutrition data while Vision finishes and the suggestion is prepared
+            nutrition_task = asyncio.create_task(get_nutrition_data_async(main_ingredient))
+            tasks.append(nutrition_task)
+            
+            # CLIP may have finished before Vision answered
+            if detected_food is None:
+                detected_food, _ = await vision_task
+                logger.info(f"Detected foods: {detected_food}")
+                yield {"detected_food": detected_food}
+            
+            # Only cache results that are not errors
+            vision_failed = detected_food[0].startswith("Error in Vision API")
+            clip_failed = main_ingredient.startswith("Error in CLIP Model")
+            if not vision_failed and not clip_failed:
+                PIPELINE_CACHE[image_key] = (detected_food, main_ingredient)
+        
+        # Suggest a healthier alternative
+        alternative_suggestion = suggest_alternative(main_ingredient)
+        logger.info(f"Alternative suggestion: {alternative_suggestion}")
+        
+        # Get nutrition data
+        nutrition_info = await nutrition_task
+        logger.info(f"Nutrition info: {nutrition_info}")
+        
+        yield {"nutrition_info": nutrition_info}
+        yield {"healthier_alternative": alternative_suggestion}
+    finally:
+        # Stop outstanding work if the client went away mid-stream
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+# Serialize partial analysis results as newline-delimited JSON
+async def stream_analysis(image_bytes):
+    """Yields one JSON line per partial analysis result"""
+    try:
+        async for partial_result in analyze_image(image_bytes):
+            yield json.dumps(partial_result) + "\n"
+    except Exception as e:
+        logger.error(f"Unexpected error in food analysis: {e}")
+        yield json.dumps({"error": str(e)}) + "\n"
 
 # Vercel serverless function handler
 @app.post("/api/analyze-food")
@@ -190,28 +751,14 @@ async def analyze_food(request: Request):
         # Read image bytes
         image_bytes = await image_file.read()
         
-        # Detect food using Google Vision API
-        detected_food = detect_food_vision(image_bytes)
-        logger.info(f"Detected foods: {detected_food}")
-        
-        # Classify main ingredient using CLIP
-        main_ingredient = classify_ingredients(image_bytes)
-        logger.info(f"Main ingredient: {main_ingredient}")
-        
-        # Get nutrition data
-        nutrition_info = get_nutrition_data(main_ingredient)
-        logger.info(f"Nutrition info: {nutrition_info}")
-        
-        # Suggest a healthier alternative
-        alternative_suggestion = suggest_alternative(main_ingredient)
-        logger.info(f"Alternative suggestion: {alternative_suggestion}")
+        # Clients that accept NDJSON get each part of the result as soon as it is ready
+        if "application/x-ndjson" in request.headers.get("accept", ""):
+            return StreamingResponse(stream_analysis(image_bytes), media_type="application/x-ndjson")
         
-        return {
-            "detected_food": detected_food,
-            "main_ingredient": main_ingredient,
-            "nutrition_info": nutrition_info,
-            "healthier_alternative": alternative_suggestion
-        }
+        result = {}
+        async for partial_result in analyze_image(image_bytes):
+            result.update(partial_result)
+        return result
     
     except Exception as e:
         logger.error(f"Unexpected error in food analysis: {e}")
@@ -220,4 +767,15 @@ async def analyze_food(request: Request):
 # For development purposes
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    workers = int(os.getenv("WEB_CONCURRENCY", max(1, (os.cpu_count() or 2) - 1)))
+    # uvicorn[standard] provides uvloop and httptools, which "auto" picks up
+    uvicorn.run(
+        f"{os.path.splitext(os.path.basename(__file__))[0]}:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="auto",
+        workers=workers,
+        log_level="info",
+    )
\ No newline at end of file